@@ -2,5 +2,5 @@
 from importlib.metadata import version
 __version__ = version("modelling_tools")
 
-from modelling_tools.runModel import runModel
+from modelling_tools.runModel import runModel, runModelBatch, runModelSweep, runModelSweepCUDA
 from modelling_tools.model_summary import calculate_MSPE, calculate_CCC, plot_model_output
\ No newline at end of file
@@ -0,0 +1,84 @@
+import functools
+import numpy as np
+try:
+    from numba import cuda, float64
+except ImportError as error:
+    raise ImportError("runModelSweepCUDA() needs numba, which is not installed") from error
+
+"""
+4th-order Runge Kutta driver for NVIDIA GPUs, used by runModelSweepCUDA()
+
+Each GPU thread integrates one run of the sweep. The model function follows the same in-place array contract as
+compiled models (see _rk4_numba.py), but must be compiled as a CUDA device function:
+
+    @cuda.jit(device=True)
+    def model_function(parameters, stateVars, t, differential_return, variable_returns): ...
+
+The slopes and outputs live in per-thread local memory, so this suits small models run many (thousands or more) times.
+runModel.py only imports this module when runModelSweepCUDA() is called.
+"""
+
+_THREADS_PER_BLOCK = 256
+
+
+@functools.lru_cache(maxsize=None)
+def _sweep_kernel(model_function, n_state, n_out):
+    # local arrays need sizes known at compile time, so one kernel is compiled per model and model size
+    @cuda.jit
+    def kernel(states, params_arr, t0, integInt, n_steps, comm_stride, out_buf):
+        i = cuda.grid(1)
+        if i >= states.shape[0]:
+            return
+        state = states[i]
+        params = params_arr[i]
+        k = cuda.local.array((4, n_state), float64) # slopes (diff eqn results) for each part of Runge-Kutta
+        start = cuda.local.array(n_state, float64) # stateVar values at beginning of current integInt
+        variable_returns = cuda.local.array(n_out, float64)
+        half_step = integInt / 2
+        sixth_step = integInt / 6
+
+        t = t0
+        model_function(params, state, t, k[0], variable_returns)
+        for outno in range(n_out):
+            out_buf[i, 0, outno] = variable_returns[outno]
+
+        row_idx = 1
+        steps_since_comm = 0
+        for intervalNo in range(n_steps):
+            for svno in range(n_state):
+                start[svno] = state[svno]
+            # same parts, stage times and operation order as _rk4_core
+            model_function(params, state, t, k[0], variable_returns)
+            for svno in range(n_state):
+                state[svno] = start[svno] + half_step * k[0, svno]
+            model_function(params, state, t + half_step, k[1], variable_returns)
+            for svno in range(n_state):
+                state[svno] = start[svno] + half_step * k[1, svno]
+            model_function(params, state, t + half_step, k[2], variable_returns)
+            for svno in range(n_state):
+                state[svno] = start[svno] + integInt * k[2, svno]
+            model_function(params, state, t + integInt, k[3], variable_returns)
+            for svno in range(n_state):
+                state[svno] = start[svno] + sixth_step * (k[0, svno] + 2 * k[1, svno] + 2 * k[2, svno] + k[3, svno])
+            t += integInt
+            steps_since_comm += 1
+            if steps_since_comm == comm_stride:
+                steps_since_comm = 0
+                for outno in range(n_out):
+                    out_buf[i, row_idx, outno] = variable_returns[outno]
+                row_idx += 1
+
+    return kernel
+
+
+def _sweep_cuda(states, params_arr, integInt, n_steps, comm_stride, model_results, model_function):
+    # copies the runs to the GPU, integrates them all from t = 0 and copies the results back into model_results
+    n_runs, n_state = states.shape
+    kernel = _sweep_kernel(model_function, n_state, model_results.shape[2])
+    states_d = cuda.to_device(states)
+    params_d = cuda.to_device(params_arr)
+    out_d = cuda.device_array(model_results.shape, dtype=model_results.dtype)
+    blocks = (n_runs + _THREADS_PER_BLOCK - 1) // _THREADS_PER_BLOCK
+    kernel[blocks, _THREADS_PER_BLOCK](states_d, params_d, 0.0, integInt, n_steps, comm_stride, out_d)
+    out_d.copy_to_host(model_results)
+    states_d.copy_to_host(states)
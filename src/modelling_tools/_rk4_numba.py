@@ -0,0 +1,189 @@
+import functools
+import numpy as np
+try:
+    from numba import njit, prange, cfunc, carray
+except ImportError as error:
+    raise ImportError("compiled models (jit=True, @njit model functions) and runModelSweep() need numba, "
+                      "which is not installed. Install numba or run a dict model_function with jit=False") from error
+
+"""
+Compiled 4th-order Runge Kutta driver used by runModel()
+
+runModel() switches to this driver when model_function has been compiled with numba (@njit).
+Compiled model functions cannot build dictionaries or use locals(), so they follow an array contract:
+
+    model_function(parameters, stateVars, t, differential_return, variable_returns), returns nothing
+
+    parameters = np.ndarray, parameter values in the same order as the parameters dict
+    stateVars = np.ndarray, current state variables
+    differential_return = np.ndarray to fill in place, same number and order as stateVars
+    variable_returns = np.ndarray to fill in place, same number and order as outputs_list
+
+Both output arrays are allocated once per run and reused for every call, so the model must assign every element.
+
+numba is optional: runModel() only imports this module once it is given a compiled model_function.
+"""
+
+@functools.lru_cache(maxsize=None)
+def _compile_rhs(model_function):
+    # one compiled model per Python function, shared by every runModel()/runModelSweep() call in the session,
+    # so repeated runs never recompile it. cache=True also stores the machine code next to the user's source,
+    # so a new session loads it from disk instead of compiling again
+    try:
+        return njit(cache=True)(model_function)
+    except RuntimeError:
+        # no source file to cache next to (defined in a notebook cell on some setups, exec, python -c, stdin):
+        # compile once per session only
+        return njit(model_function)
+
+
+# no cache=True: both drivers are specialized on the model function passed as rhs, and that type differs
+# in every new process, so numba would write a new, never reused, cache entry on each run
+
+# nogil: the compiled loop releases the GIL, so runs started from separate threads execute in parallel
+@njit(nogil=True)
+def _rk4_core(state, params_arr, t0, integInt, n_steps, comm_stride, out_buf, rhs):
+    # state is updated in place, out_buf receives one row of outputs per communication interval
+    n_state = state.shape[0]
+    k = np.empty((4, n_state)) # slopes (diff eqn results) for each part of Runge-Kutta
+    start = np.empty(n_state) # stateVar values at beginning of current integInt
+    variable_returns = np.empty(out_buf.shape[1]) # filled by rhs on every call, stored on communication steps
+    rk4_nodes = (0.0, integInt / 2, integInt / 2, integInt) # time into integInt at which each part of Runge-Kutta is evaluated
+    sixth_step = integInt / 6
+
+    t = t0
+    row_idx = 0
+    steps_since_comm = 0 # integration intervals since the last communication time
+    for intervalNo in range(n_steps):
+        start[:] = state
+        # element loops rather than array expressions: numba allocates a temporary array for every
+        # array expression, which costs more than the arithmetic for the small systems typical here
+        for n in range(4): # 4 parts to Runge-Kutta estimation of new state
+            rhs(params_arr, state, t + rk4_nodes[n], k[n], variable_returns) # slopes go straight into k[n]
+            if n < 3: # state for the next part: start + (time to the next part) * this slope
+                for svno in range(n_state):
+                    state[svno] = start[svno] + rk4_nodes[n + 1] * k[n, svno]
+        # use all 4 slopes to estimate new state
+        for svno in range(n_state):
+            state[svno] = start[svno] + sixth_step * (k[0, svno] + 2 * k[1, svno] + 2 * k[2, svno] + k[3, svno])
+        t += integInt
+        steps_since_comm += 1
+        if steps_since_comm == comm_stride:
+            steps_since_comm = 0
+            out_buf[row_idx, :] = variable_returns
+            row_idx += 1
+    return t
+
+
+@njit(parallel=True)
+def _sweep_core(states, params_arr, t0, integInt, n_steps, comm_stride, out_buf, rhs):
+    # one independent run per row of states/params_arr, spread across threads by prange
+    # out_buf[i] receives the t0 row followed by one row per communication interval of run i
+    for i in prange(states.shape[0]):
+        differential_return = np.empty(states.shape[1])
+        variable_returns = np.empty(out_buf.shape[2])
+        rhs(params_arr[i], states[i], t0, differential_return, variable_returns)
+        out_buf[i, 0, :] = variable_returns
+        # _rk4_core allocates its own slopes/start buffers, so they are private to each thread
+        _rk4_core(states[i], params_arr[i], t0, integInt, n_steps, comm_stride, out_buf[i, 1:], rhs)
+
+
+# Cash-Karp embedded Runge-Kutta 4(5) pair: stage times, stage weights and the 5th and 4th order solution weights
+_CK_C = np.array([0.0, 1/5, 3/10, 3/5, 1.0, 7/8])
+_CK_A = np.array([[0.0, 0.0, 0.0, 0.0, 0.0],
+                 [1/5, 0.0, 0.0, 0.0, 0.0],
+                 [3/40, 9/40, 0.0, 0.0, 0.0],
+                 [3/10, -9/10, 6/5, 0.0, 0.0],
+                 [-11/54, 5/2, -70/27, 35/27, 0.0],
+                 [1631/55296, 175/512, 575/13824, 44275/110592, 253/4096]])
+_CK_B5 = np.array([37/378, 0.0, 250/621, 125/594, 0.0, 512/1771])
+_CK_B4 = np.array([2825/27648, 0.0, 18575/48384, 13525/55296, 277/14336, 1/4])
+
+
+@njit(nogil=True)
+def _cashkarp_core(state, params_arr, t0, t_stops, rtol, atol, h, out_buf, rhs):
+    # adaptive step size from t0 through every time in t_stops, steps are shortened to land exactly on each stop
+    # out_buf receives the outputs at the first out_buf.shape[0] stops, state is left at the last stop
+    # h is the first step size tried
+    n_state = state.shape[0]
+    k = np.empty((6, n_state)) # slopes for each stage of the Cash-Karp pair
+    stage = np.empty(n_state)
+    y5 = np.empty(n_state)
+    variable_returns = np.empty(out_buf.shape[1])
+
+    t = t0
+    for row_idx in range(t_stops.shape[0]):
+        t_stop = t_stops[row_idx]
+        while t < t_stop:
+            last = h >= t_stop - t
+            h_try = t_stop - t if last else h
+            if t + h_try == t:
+                raise RuntimeError("cashkarp step size fell below the resolution of t, the model may be too stiff "
+                                   "or return nan")
+            rhs(params_arr, state, t, k[0], variable_returns)
+            for s in range(1, 6):
+                for svno in range(n_state):
+                    stage[svno] = state[svno]
+                    for j in range(s):
+                        stage[svno] += h_try * _CK_A[s, j] * k[j, svno]
+                rhs(params_arr, stage, t + _CK_C[s] * h_try, k[s], variable_returns)
+            # 5th order solution and the largest error, relative to the tolerance, of the embedded 4th order one
+            err = 0.0
+            for svno in range(n_state):
+                y5[svno] = state[svno]
+                y4 = state[svno]
+                for s in range(6):
+                    y5[svno] += h_try * _CK_B5[s] * k[s, svno]
+                    y4 += h_try * _CK_B4[s] * k[s, svno]
+                scale = atol + rtol * max(abs(state[svno]), abs(y5[svno]))
+                svno_err = abs(y5[svno] - y4) / scale
+                if svno_err > err or np.isnan(svno_err): # max() would drop a nan, it must reject the step
+                    err = svno_err
+            if err <= 1.0: # accept the step if it is within tolerance
+                state[:] = y5
+                t = t_stop if last else t + h_try
+                if last and h_try < h:
+                    continue # shortened to reach the stop, its error says nothing about the next step size
+            if err == 0.0:
+                factor = 5.0
+            elif err > 0.0:
+                factor = min(5.0, max(0.1, 0.9 * err ** -0.2))
+            else:
+                factor = 0.1 # nan from the model, retry with a much smaller step
+            h = h_try * factor
+        if row_idx < out_buf.shape[0]:
+            # outputs at the exact state on the stop
+            rhs(params_arr, state, t, k[0], variable_returns)
+            out_buf[row_idx, :] = variable_returns
+    return t
+
+
+@functools.lru_cache(maxsize=None)
+def _lsoda_rhs(model_function, n_state, n_params, n_out):
+    # numbalsoda calls a C function rhs(t, u, du, p) with raw pointers, so array sizes are fixed when it is compiled
+    from numbalsoda import lsoda_sig
+
+    @cfunc(lsoda_sig)
+    def rhs(t, u, du, p):
+        variable_returns = np.empty(n_out) # not needed by the solver
+        model_function(carray(p, (n_params,)), carray(u, (n_state,)), t, carray(du, (n_state,)), variable_returns)
+
+    return rhs
+
+
+def _lsoda_results(model_function, params_arr, state, t0, t_stops, rtol, atol, out_buf):
+    # integrates with numbalsoda's LSODA from t0 through every time in t_stops, solver steps never return to Python
+    # out_buf receives the outputs at the first out_buf.shape[0] stops, state is left at the last stop
+    from numbalsoda import lsoda
+    rhs = _lsoda_rhs(model_function, state.shape[0], params_arr.shape[0], out_buf.shape[1])
+    usol, success = lsoda(rhs.address, state, np.append(t0, t_stops), data=params_arr, rtol=rtol, atol=atol)
+    if not success:
+        raise RuntimeError("numbalsoda lsoda failed, try a larger rtol/atol or a shorter communInt")
+
+    # outputs are only needed at communication times, evaluate the model once at each of them
+    differential_return = np.empty(state.shape[0])
+    variable_returns = np.empty(out_buf.shape[1])
+    for row_idx in range(out_buf.shape[0]):
+        model_function(params_arr, usol[row_idx + 1], t_stops[row_idx], differential_return, variable_returns)
+        out_buf[row_idx] = variable_returns
+    state[:] = usol[-1]
@@ -1,13 +1,12 @@
-import pandas as pd
-import math
-import matplotlib.pyplot as plt
+import numpy as np
 
-def calculate_MSPE(pred_mean, obs_mean, pred_std, obs_std, corr_coef) -> float:
+# Both accept single values or numpy arrays with one value per column, and return the same shape
+def calculate_MSPE(pred_mean, obs_mean, pred_std, obs_std, corr_coef) -> float | np.ndarray:
     return (pred_mean - obs_mean)**2 + (pred_std - corr_coef*obs_std)**2 + (1-corr_coef**2)*obs_std**2
 
 
-def calculate_CCC(pred_mean, obs_mean, pred_std, obs_std, corr_coef) -> float:
-    u = (pred_mean - obs_mean) / math.sqrt(pred_std * obs_std)
+def calculate_CCC(pred_mean, obs_mean, pred_std, obs_std, corr_coef) -> float | np.ndarray:
+    u = (pred_mean - obs_mean) / np.sqrt(pred_std * obs_std)
     v = pred_std / obs_std
     Cb = ((v + 1/v + u**2)/2)**-1
     return corr_coef * Cb
@@ -15,6 +14,8 @@ def calculate_CCC(pred_mean, obs_mean, pred_std, obs_std, corr_coef) -> float:
 
 def plot_model_output(observations,
                       results):
+    # imported here so `import modelling_tools` does not load matplotlib unless something is plotted
+    import matplotlib.pyplot as plt
     
     ### Check column names match ###
     column_names = list(observations.columns)
@@ -30,47 +31,32 @@ def plot_model_output(observations,
 ########################
 # Generate summary statistics for dataframes
 ########################
+    # Compare float32 results (runModel(..., dtype=np.float32)) against observations at the same precision
+    observations = observations.astype({name: np.float32 for name in column_names if results[name].dtype == np.float32})
+
+    # One array per statistic, in the order of column_names, so MSPE and CCC are computed for every column in one call
     # Observation Statitics
-    obs_means = observations.mean()
-    obs_std = observations.std()
-    observations_stats = pd.DataFrame({'Mean': obs_means, 'Std Deviation': obs_std})
+    obs_mean = observations[column_names].mean().to_numpy()
+    obs_std = observations[column_names].std().to_numpy()
 
     # Results Statistics
-    results_means = results.mean()
-    results_std = results.std()
-    results_stats = pd.DataFrame({"Mean": results_means, "Std Deviation": results_std})
+    pred_mean = results[column_names].mean().to_numpy()
+    pred_std = results[column_names].std().to_numpy()
 
-    # Pearson Correlation Coefficients
-    corr_results = {}
-    for name in column_names:
-        correlation = observations[name].corr(results[name])
-        corr_results[name] = correlation 
+    # Pearson Correlation Coefficients, every column in one pass (rows are aligned on the index, as with Series.corr)
+    corr_coef = observations[column_names].corrwith(results[column_names]).loc[column_names].to_numpy()
 
 ########################
 # Calculate MSPE
 ########################
-    MSPE_results = {}
     # Calculate MSPE for each observation column
-    for name in column_names:
-        MSPE = calculate_MSPE(results_stats.loc[name, "Mean"],
-                              observations_stats.loc[name, "Mean"], 
-                              results_stats.loc[name, "Std Deviation"], 
-                              observations_stats.loc[name, "Std Deviation"],
-                              corr_results[name])
-        MSPE_results[name] = MSPE
+    MSPE_results = dict(zip(column_names, calculate_MSPE(pred_mean, obs_mean, pred_std, obs_std, corr_coef)))
 
 ########################
 # Calculate CCC
 ########################
-    CCC_results = {}
     # Calculate CCC for each observation column
-    for name in column_names:
-        CCC = calculate_CCC(results_stats.loc[name, "Mean"],
-                            observations_stats.loc[name, "Mean"], 
-                            results_stats.loc[name, "Std Deviation"], 
-                            observations_stats.loc[name, "Std Deviation"],
-                            corr_results[name])
-        CCC_results[name] = CCC
+    CCC_results = dict(zip(column_names, calculate_CCC(pred_mean, obs_mean, pred_std, obs_std, corr_coef)))
 
 ########################
 # Create plot
@@ -78,7 +64,7 @@ def plot_model_output(observations,
     # Calculate the number of rows and columns for the grid
     num_plots = len(column_names)
     num_cols = 3  # You can adjust the number of columns as needed
-    num_rows = math.ceil(num_plots / num_cols)
+    num_rows = int(np.ceil(num_plots / num_cols))
 
     # Create a grid of subplots
     fig, axs = plt.subplots(num_rows, num_cols, figsize=(15, 5 * num_rows))
@@ -1,5 +1,13 @@
+import functools
+import inspect
+import logging
+import sys
+import numpy as np
 import pandas as pd
 from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
 
 """
 John's runModel function
@@ -12,21 +20,49 @@ runModel(
     output_file, filename, filepath, fileext
     ), where
     Start = 0 (to start from time = 0), or Start = 1 (to continue from previous run)
-    runTime = duration of simulation in user-defined time units
+    runTime = duration of simulation in user-defined time units, a whole number of integInt
     integInt = integration interval in user-defined time units
-    communInt = time interval for communicating results to csv file
+    communInt = time interval for communicating results to csv file, a whole number of integInt
 
     outputs_list = list, names of variables to include in output
     parameters = dict, dictionary with all model parameters
     initial_stateVars = list, all initial state variables
-    model_function = function, name of function with model equations
+    model_function = function, name of function with model equations. It is called with positional arguments
+        model_function(parameters, stateVars, outputs_list, t), so it must accept them in that order.
+        It may also accept a fifth argument named need_outputs: it is then False whenever the returned outputs are
+        not stored (most calls) and the function can return None instead of computing them.
+        If model_function is compiled with numba (@njit) the Runge-Kutta loop is also compiled,
+        see _rk4_numba.py for the array contract compiled model functions must follow
 
     prev_output = if Start == 1 then must specificy the dataframe that was output from previous run
+        or a list of dataframes, one per previous run. With a list the new results are appended to it as another
+        dataframe and the list is returned, so chained runs avoid copying all earlier results on every call;
+        join them once at the end with pd.concat(prev_output, ignore_index=True). output_file then saves the new run only
 
     output_file = True/False - should output be exported to a csv file? Default is False.
-    filepath = file path to the folder to save the file in. Default is './' (which means current directory)
+    filepath = file path to the folder to save the file in, with or without a trailing '/'. Default is './' (which means current directory)
     filename = name of the file (without extension). Date/time automatically added after this name. Default is 'generic'
-    fileextension = extension to save file with. Default is '.csv'
+    fileextension = extension to save file with. Default is '.csv'. '.csv.gz', '.csv.bz2', '.csv.zip' or '.csv.xz' save a compressed csv
+
+    method = 'rk4' (default) for fixed-step 4th-order Runge Kutta, or the name of a scipy.integrate.solve_ivp method
+        ('RK45', 'RK23', 'DOP853', 'Radau', 'BDF', 'LSODA') for adaptive step size. Requires scipy.
+        Adaptive methods only use integInt to place the communication times and evaluate outputs at the exact state.
+        'cashkarp' is an adaptive Cash-Karp Runge Kutta 4(5) pair run entirely in compiled code, for compiled model
+        functions only (needs numba, not scipy). It tries integInt as its first step and lands exactly on each communication time
+        'numbalsoda' is LSODA (automatic stiff/non-stiff switching) from the numbalsoda package, for compiled model
+        functions only. Like 'cashkarp' it never returns to Python between communication times, unlike scipy's 'LSODA'
+    rtol, atol = relative and absolute error tolerances for adaptive methods. Defaults are 1e-6 and 1e-9
+    jac = optional function jac(t, stateVars) returning the Jacobian matrix, used by the implicit methods ('Radau', 'BDF', 'LSODA')
+
+    dtype = numpy dtype used to store the results. Default is np.float64. np.float32 halves the memory of long runs;
+        integration is always done in float64, but results are only bit-for-bit reproducible with the float64 default
+    return_trajectory = True/False - return the output dataframe? Default is True. If False, no results are stored
+        (and no file is written) and only an array of the final state variables is returned, e.g. for fitting loops
+    jit = True/False - compile model_function with numba before running? Default is False. model_function must follow the
+        array contract in _rk4_numba.py. Each function is compiled once per session and cached on disk between sessions
+    verbose = True/False - print the output dataframe at the end of the run? Default is False.
+        Progress messages ("Running Model....", file saved) are logged at INFO level to the 'modelling_tools.runModel'
+        logger, show them with e.g. logging.basicConfig(level=logging.INFO)
 
 """
 def runModel(Start, 
@@ -41,112 +77,475 @@ def runModel(Start,
              output_file = False,
              filepath = './',
              filename = 'generic',
-             fileextension = '.csv'
+             fileextension = '.csv',
+             method = 'rk4',
+             rtol = 1e-6,
+             atol = 1e-9,
+             jac = None,
+             dtype = np.float64,
+             return_trajectory = True,
+             jit = False,
+             verbose = False
              ):
     
     ### Setup Integration and Communication Loop ###
-    lastIntervalNo=runTime/integInt 
-    intervalNoForComm=communInt/integInt
-    cintAsInt=int(intervalNoForComm)
+    lastIntervalNo, cintAsInt = _interval_counts(runTime, integInt, communInt)
+
+    # one row per communication interval, plus the t=0 row for a new simulation
+    n_comm_rows = lastIntervalNo // cintAsInt + (1 if Start == 0 else 0)
+    if not return_trajectory:
+        # only the final state is returned: no step is a communication step, keep a single row for the t=0 outputs
+        cintAsInt = lastIntervalNo + 1
+        n_comm_rows = 1 if Start == 0 else 0
 
     ### Initialize Lists ###
-    model_results = []  # Store model results, a list of lists
-    slopes=[] # list to hold slopes (diff eqn results) for Runge-Kutta
-    start=[] # list to hold stateVar values at beginning of current integInt
+    model_results = np.empty((n_comm_rows, len(outputs_list)), dtype=dtype) # Store model results, one row per communication time
+    row_idx = 0 # next row of model_results to fill
+    half_step = integInt / 2 # time into integInt at which parts 2 and 3 of Runge-Kutta are evaluated
+    sixth_step = integInt / 6 # weight of the slopes in the final Runge-Kutta estimate
     
-    print("Running Model....")
+    logger.info("Running Model....")
+
+    if jit and not _is_jitted(model_function): # an @njit model is already compiled
+        from modelling_tools._rk4_numba import _compile_rhs
+        model_function = _compile_rhs(model_function)
+    compiled = _is_jitted(model_function)
+    if compiled:
+        # compiled models index parameters by position, in the order of the parameters dict
+        parameters = np.array(list(parameters.values()), dtype=np.float64)
 
     ####################
     # Start New Simulation
     ####################
     if Start==0: # start from t=0 instead of continue from where it left off
         t=0.0 # start time for simulation
-        stateVars = initital_stateVars.copy()
-        # Create copy of the initial state variables 
-        # Run model at time=0, uses initial state variables that user input
-        differential_return, variable_returns = model_function(parameters=parameters,
-                                                               stateVars=initital_stateVars,
-                                                               outputs_list=outputs_list,
-                                                               t=t
-                                                               ) 
-        model_results.append(variable_returns)        
-            # dynamic() now returns a list of variables that can be appended into model_results
+        stateVars = np.array(initital_stateVars, dtype=np.float64)
+        # Create copy of the initial state variables, one float64 array updated in place for the whole run
 
     ####################
     # Continue Simulation
     ####################
     if Start == 1:
         # check that prev_output has been included
-        if not isinstance(prev_output, pd.DataFrame):
-            raise TypeError("The variable prev_output must be a dataframe if Start == 1")
-        
-        t = prev_output['t'].iloc[-1]
+        if isinstance(prev_output, list) and len(prev_output) > 0:
+            t = prev_output[-1]['t'].iloc[-1]
+        elif isinstance(prev_output, pd.DataFrame):
+            t = prev_output['t'].iloc[-1]
+        else:
+            raise TypeError("The variable prev_output must be a dataframe or a list of dataframes if Start == 1")
         # stateVars = prev_output.iloc[-1, 1:].tolist()
-        stateVars = initital_stateVars.copy()
+        stateVars = np.array(initital_stateVars, dtype=np.float64)
+
+    # Run model at the start time, uses initial state variables that user input
+    # (for every Start, so a model returning the wrong number of values fails here rather than mid-run)
+    if compiled:
+        # compiled models fill arrays in place and are not bounds checked; this one call runs uncompiled
+        # (py_func) so numpy raises an IndexError if the model writes past the end of either array
+        differential_return = np.empty(len(stateVars))
+        variable_returns = np.empty(len(outputs_list))
+        model_function.py_func(parameters, stateVars, t, differential_return, variable_returns)
+    elif _takes_need_outputs(model_function):
+        differential_return, variable_returns = model_function(parameters, stateVars.tolist(), outputs_list, t, True)
+    else:
+        differential_return, variable_returns = model_function(parameters, stateVars.tolist(), outputs_list, t)
+    if len(differential_return) != len(stateVars) or len(variable_returns) != len(outputs_list):
+        # the Runge-Kutta loop relies on these positions being fixed for the whole run
+        raise ValueError("model_function must return one differential per state variable and one value per name in outputs_list")
+    if Start==0:
+        model_results[row_idx] = variable_returns
+        row_idx += 1
+            # dynamic() now returns a list of variables that can be written into a row of model_results
 
     ####################
     # 4th-order Runge Kutta
     ####################
     # 4th-order Runge Kutta algorithm to iterate through dynamic() between t = 0 and tStop
-    for intervalNo in range(int(lastIntervalNo)):
-        for n in range(4): # 4 parts to Runge-Kutta estimation of new state
-            # eval model fluxes and store diff eqn results in slopes[part][statevar] for 
-            # each part of Runge-Kutta by calling dynamic() here:
-            differential_return, variable_returns = model_function(parameters=parameters,
-                                                                   stateVars=stateVars,
-                                                                   outputs_list=outputs_list,
-                                                                   t=t
-                                                                   )
-            slopes.append(differential_return)  # Add list of differentials
-            for svno in range(len(stateVars)): # estimate new stateVar values 1 at a time
-                match n:
-                    case 0: # if part 1 of Runge-Kutta, record state at beginning of integInt
-                        start.append(stateVars[svno]) # to be used throughout
-                        newStateVar = start[svno] + integInt * slopes[n][svno] / 2
-                    case 1: # if part 2 of Runge Kutta
-                        newStateVar=start[svno]+integInt*slopes[n][svno]/2
-                    case 2: # if part 3 of Runge Kutta
-                        newStateVar=start[svno]+integInt*slopes[n][svno]
-                    case 3: # if part 4 of Runge-Kutta, use all 4 slopes to estimate new state
-                        newStateVar=start[svno]+integInt/6*(slopes[0][svno]+2*slopes[1][svno]+
-                            2*slopes[2][svno]+slopes[3][svno])
-                        
-                stateVars[svno]=newStateVar 
-                    # update stateVars w new values after each part of Runge-Kutta:
-        # end of one iteration thru complete 4th-order Runge-Kutta algorithm = 1 integInt
-        t+=integInt 
-            # increment time to associate with new state
-        # output results of new state if new time is a communication time
-        # current intervalNo is associated with old time so intervalNo+1 is used
-        remainder=(intervalNo+1)/cintAsInt-int((intervalNo+1)/cintAsInt)
-        if remainder==0:
-            model_results.append(variable_returns.copy()) # appends pointer to temp outputRow so need to append copy
-        slopes.clear() # clear slopes list for next integInt
-        start.clear() # clear temp list for next integInt
+    if method in ('cashkarp', 'numbalsoda'):
+        if not compiled:
+            raise ValueError("method='" + method + "' needs a compiled model_function (@njit or jit=True), "
+                             "use method='RK45' or 'LSODA' for other models")
+        # integInt times a whole number of intervals, computed like the end time so the last stop never rounds past it
+        t_stops = t + integInt * (cintAsInt * np.arange(1, n_comm_rows - row_idx + 1))
+        if len(t_stops) == 0 or lastIntervalNo % cintAsInt != 0:
+            # keep integrating past the last communication time to the end of the run
+            t_stops = np.append(t_stops, t + lastIntervalNo * integInt)
+        if method == 'cashkarp':
+            from modelling_tools._rk4_numba import _cashkarp_core
+            _cashkarp_core(stateVars, parameters, t, t_stops, rtol, atol, integInt, model_results[row_idx:], model_function)
+        else:
+            from modelling_tools._rk4_numba import _lsoda_results
+            _lsoda_results(model_function, parameters, stateVars, t, t_stops, rtol, atol, model_results[row_idx:])
+    elif method != 'rk4':
+        # adaptive step size, scipy chooses the steps and reports the state at each communication time
+        t_end = t + lastIntervalNo * integInt
+        # integInt times a whole number of intervals, computed like t_end so the last time never rounds past it
+        t_eval = t + integInt * (cintAsInt * np.arange(1, n_comm_rows - row_idx + 1))
+        _solve_ivp_results(model_function, compiled, parameters, stateVars, t, t_end, t_eval, outputs_list,
+                           model_results[row_idx:], method, rtol, atol, jac)
+    elif compiled:
+        # whole loop runs in compiled code, filling the remaining rows of model_results
+        from modelling_tools._rk4_numba import _rk4_core
+        _rk4_core(stateVars, parameters, t, integInt, lastIntervalNo, cintAsInt, model_results[row_idx:], model_function)
+    else:
+        # Python model functions get plain lists: for the handful of state variables in a typical model, scalar float
+        # arithmetic in a list comprehension is faster than numpy ufuncs on tiny arrays
+        stateVars = stateVars.tolist()
+        svnos = range(len(stateVars)) # state variable numbers
+        steps_since_comm = 0 # integration intervals since the last communication time
+        takes_need_outputs = _takes_need_outputs(model_function)
+        # the outputs of the first 3 parts are never stored
+        rhs = functools.partial(model_function, need_outputs=False) if takes_need_outputs else model_function
+        for intervalNo in range(lastIntervalNo):
+            start = stateVars # record state at beginning of integInt, to be used throughout
+            # 4 parts to Runge-Kutta estimation of new state, each evaluating the slopes (diff eqn results)
+            # at the state estimated from the previous part
+            k1 = rhs(parameters, start, outputs_list, t)[0]
+            stateVars = [start[i] + half_step * k1[i] for i in svnos]
+            t_half = t + half_step
+            k2 = rhs(parameters, stateVars, outputs_list, t_half)[0]
+            stateVars = [start[i] + half_step * k2[i] for i in svnos]
+            k3 = rhs(parameters, stateVars, outputs_list, t_half)[0]
+            stateVars = [start[i] + integInt * k3[i] for i in svnos]
+            if takes_need_outputs: # outputs of the 4th part are only stored on communication steps
+                k4, variable_returns = model_function(parameters, stateVars, outputs_list, t + integInt,
+                                                      need_outputs=steps_since_comm + 1 == cintAsInt)
+            else:
+                k4, variable_returns = model_function(parameters, stateVars, outputs_list, t + integInt)
+            # use all 4 slopes to estimate new state
+            stateVars = [start[i] + sixth_step * (k1[i] + 2 * k2[i] + 2 * k3[i] + k4[i]) for i in svnos]
+            # end of one iteration thru complete 4th-order Runge-Kutta algorithm = 1 integInt
+            t+=integInt 
+                # increment time to associate with new state
+            # output results of new state if new time is a communication time
+            steps_since_comm += 1
+            if steps_since_comm == cintAsInt:
+                steps_since_comm = 0
+                model_results[row_idx] = variable_returns # row assignment copies the values
+                row_idx += 1
+        stateVars = np.array(stateVars)
+
+    if not return_trajectory:
+        logger.info("Running Model....DONE")
+        return stateVars
 
     ####################
     # Export Model Results
     ####################
-    output_dataframe = pd.DataFrame(model_results, columns = outputs_list)
+    output_dataframe = pd.DataFrame(model_results, columns = outputs_list, copy=False)
 
-    if Start == 1:
+    if Start == 1 and isinstance(prev_output, list):
+        # keep runs as separate dataframes, joining here would copy every earlier run again on each call
+        prev_output.append(output_dataframe)
+    elif Start == 1:
         # join new data onto previous data
         output_dataframe = pd.concat([prev_output,output_dataframe], ignore_index=True)
 
     if output_file == True:
         # get current date/time as string
-        timestamp = datetime.datetime.now().strftime('%y%m%d_%H%M%S') 
+        timestamp = datetime.now().strftime('%y%m%d_%H%M%S')
         
         # put together full filename and path
-        full_filename = filepath + filename + timestamp + fileextension
-        print("File saved to: " + full_filename)
+        full_filename = Path(filepath) / (filename + timestamp + fileextension)
+        logger.info("File saved to: %s", full_filename)
 
-        # save to csv
+        # save to csv, pandas writes it in chunks of rows and compresses according to the extension
         output_dataframe.to_csv(full_filename, index=False)
     
-    print(output_dataframe)
+    if verbose:
+        print(output_dataframe)
 
-    print("Running Model....DONE")
+    logger.info("Running Model....DONE")
 
-    # return the dataframe to be used later
+    # return the dataframe (or list of dataframes) to be used later
+    if Start == 1 and isinstance(prev_output, list):
+        return prev_output
     return output_dataframe
+
+
+def _interval_counts(runTime, integInt, communInt):
+    # number of integration intervals in the run and in each communication interval, as exact integers
+    # (int(communInt/integInt) alone truncates e.g. 0.3/0.1 = 2.9999999999999996 to 2)
+    lastIntervalNo = int(round(runTime / integInt))
+    cintAsInt = int(round(communInt / integInt))
+    if abs(lastIntervalNo * integInt - runTime) > 1e-9 * runTime:
+        raise ValueError("runTime must be a whole number of integInt")
+    if cintAsInt < 1 or abs(cintAsInt * integInt - communInt) > 1e-9 * communInt:
+        raise ValueError("communInt must be a whole number of integInt")
+    return lastIntervalNo, cintAsInt
+
+
+def _takes_need_outputs(model_function):
+    # Python model functions can opt in to being told when their outputs are not needed
+    try:
+        return 'need_outputs' in inspect.signature(model_function).parameters
+    except (TypeError, ValueError): # callables without a signature, e.g. some builtins
+        return False
+
+
+def _is_jitted(function):
+    # a compiled model_function means numba has already been imported,
+    # so `import modelling_tools` never has to import numba just to check
+    if sys.modules.get('numba') is None:
+        return False
+    from numba.extending import is_jitted
+    return is_jitted(function)
+
+
+def _solve_ivp_results(model_function, compiled, parameters, stateVars, t, t_end, t_eval, outputs_list,
+                       out_buf, method, rtol, atol, jac):
+    # integrates with scipy from t to t_end, fills out_buf with the outputs at each t_eval
+    # and leaves stateVars holding the final state
+    from scipy.integrate import solve_ivp
+
+    if compiled:
+        differential_return = np.empty(len(stateVars))
+        variable_returns = np.empty(len(outputs_list))
+        def call_model(tt, y, need_outputs):
+            model_function(parameters, y, tt, differential_return, variable_returns)
+            # copies: solvers may keep the returned slopes while the buffers are refilled
+            return differential_return.copy(), variable_returns.copy()
+    elif _takes_need_outputs(model_function):
+        call_model = lambda tt, y, need_outputs: model_function(parameters, y.tolist(), outputs_list, tt, need_outputs)
+    else:
+        call_model = lambda tt, y, need_outputs: model_function(parameters, y.tolist(), outputs_list, tt)
+
+    # explicit methods warn about options they do not use, so only pass jac when one is given
+    options = {} if jac is None else {'jac': jac}
+    solution = solve_ivp(lambda tt, y: call_model(tt, y, False)[0],
+                         (t, t_end),
+                         stateVars,
+                         method=method,
+                         t_eval=t_eval if len(t_eval) > 0 else None, # None: only the final state is used
+                         rtol=rtol,
+                         atol=atol,
+                         **options
+                         )
+    if not solution.success:
+        raise RuntimeError("solve_ivp failed: " + solution.message)
+
+    # outputs are only needed at communication times, evaluate the model once at each of them
+    for row_idx, tt in enumerate(t_eval):
+        out_buf[row_idx] = call_model(tt, solution.y[:, row_idx], True)[1]
+    stateVars[:] = solution.y[:, -1]
+
+
+"""
+runModelBatch(
+    runTime, integInt, communInt,
+    outputs_list, parameters, initial_stateVars, model_function
+    ), where
+    Solves B independent simulations from t = 0 at once, with every Runge-Kutta step vectorized across the batch.
+
+    runTime, integInt, communInt, outputs_list = same as runModel()
+    parameters = dict, each value is either one number shared by every run or an array with one value per run
+    initial_stateVars = array with shape (B, number of state variables), one row of initial state variables per run
+    model_function = same function used with runModel(). stateVars[i] and parameters['name'] are arrays with one
+        value per run, so the model equations must use operators or numpy functions (np.exp, not math.exp)
+
+    dtype = same as runModel()
+
+    Returns an array with shape (B, number of communication times, len(outputs_list)),
+    so pd.DataFrame(results[i], columns=outputs_list) is the output of run i
+"""
+def runModelBatch(runTime,
+                  integInt,
+                  communInt,
+                  outputs_list,
+                  parameters,
+                  initial_stateVars,
+                  model_function,
+                  dtype = np.float64
+                  ):
+
+    ### Setup Integration and Communication Loop ###
+    lastIntervalNo, cintAsInt = _interval_counts(runTime, integInt, communInt)
+    n_comm_rows = lastIntervalNo // cintAsInt + 1
+
+    # state variables are stored one row per variable so stateVars[i] holds variable i for every run
+    stateVars = np.array(initial_stateVars, dtype=np.float64).T.copy()
+    n_state, n_runs = stateVars.shape
+
+    ### Initialize Arrays ###
+    model_results = np.empty((n_runs, n_comm_rows, len(outputs_list)), dtype=dtype)
+    k = np.empty((4, n_state, n_runs)) # slopes (diff eqn results) for each part of Runge-Kutta
+    start = np.empty((n_state, n_runs)) # stateVar values at beginning of current integInt
+    rk4_nodes = (0.0, integInt / 2, integInt / 2, integInt) # time into integInt at which each part of Runge-Kutta is evaluated
+    rk4_weights = integInt / 6 * np.array([1.0, 2.0, 2.0, 1.0]) # weight of each slope in the final Runge-Kutta estimate
+    # flat views so the final estimate is one matrix product written straight into stateVars
+    k_flat = k.reshape(4, -1)
+    stateVars_flat = stateVars.reshape(-1)
+
+    t=0.0
+    takes_need_outputs = _takes_need_outputs(model_function)
+    if takes_need_outputs:
+        differential_return, variable_returns = model_function(parameters, stateVars, outputs_list, t, True)
+    else:
+        differential_return, variable_returns = model_function(parameters, stateVars, outputs_list, t)
+    if len(differential_return) != n_state or len(variable_returns) != len(outputs_list):
+        raise ValueError("model_function must return one differential per state variable and one value per name in outputs_list")
+    for outno, value in enumerate(variable_returns):
+        model_results[:, 0, outno] = value # scalars such as t are broadcast to every run
+    row_idx = 1
+
+    ####################
+    # 4th-order Runge Kutta
+    ####################
+    steps_since_comm = 0 # integration intervals since the last communication time
+    for intervalNo in range(lastIntervalNo):
+        start[:] = stateVars
+        steps_since_comm += 1
+        comm_step = steps_since_comm == cintAsInt # are the outputs of this interval stored?
+        for n in range(4): # 4 parts to Runge-Kutta estimation of new state
+            if takes_need_outputs:
+                need_outputs = n == 3 and comm_step
+                differential_return, variable_returns = model_function(parameters, stateVars, outputs_list, t + rk4_nodes[n], need_outputs)
+            else:
+                differential_return, variable_returns = model_function(parameters, stateVars, outputs_list, t + rk4_nodes[n])
+            for svno, slope in enumerate(differential_return):
+                k[n, svno] = slope
+            if n < 3: # state for the next part: start + (time to the next part) * this slope
+                # (in-place ufuncs avoid allocating temporary (n_state, B) arrays on every part)
+                np.multiply(k[n], rk4_nodes[n + 1], out=stateVars)
+                stateVars += start
+        if comm_step:
+            # stored before the new state is written into stateVars: outputs that are rows of stateVars
+            # (e.g. A, B = stateVars ... return ..., [t, A, B]) must keep the 4th part's state, as in runModel()
+            steps_since_comm = 0
+            for outno, value in enumerate(variable_returns):
+                model_results[:, row_idx, outno] = value
+            row_idx += 1
+        # use all 4 slopes to estimate new state
+        np.dot(rk4_weights, k_flat, out=stateVars_flat)
+        stateVars += start
+        t+=integInt
+
+    return model_results
+
+
+"""
+runModelSweep(
+    runTime, integInt, communInt,
+    outputs_list, parameters, initial_stateVars, model_function
+    ), where
+    Solves many independent simulations from t = 0 in parallel, one run per thread. Requires numba.
+
+    runTime, integInt, communInt, outputs_list = same as runModel()
+    parameters = dict, each value is either one number shared by every run or an array with one value per run,
+        or a list of P dicts, one per run (e.g. Monte Carlo samples), all with the same keys. Parameters are passed to
+        model_function in the key order of the first dict
+    initial_stateVars = array with shape (P, number of state variables), one row of initial state variables per run,
+        or a single list of initial state variables shared by every run (P is then set by the parameters)
+    model_function = model function following the array contract in _rk4_numba.py,
+        compiled with numba (@njit) or a plain function that is compiled once per session
+
+    dtype = same as runModel()
+
+    The number of threads is set by numba, e.g. with the NUMBA_NUM_THREADS environment variable.
+    The compiled Runge-Kutta loop releases the GIL, so runModel() calls with compiled models started from a
+    concurrent.futures.ThreadPoolExecutor also run in parallel, e.g. when each run needs its own runTime.
+    Returns an array with shape (P, number of communication times, len(outputs_list)), same layout as runModelBatch()
+"""
+def runModelSweep(runTime,
+                  integInt,
+                  communInt,
+                  outputs_list,
+                  parameters,
+                  initial_stateVars,
+                  model_function,
+                  dtype = np.float64
+                  ):
+
+    from modelling_tools._rk4_numba import _compile_rhs, _sweep_core
+    if not _is_jitted(model_function):
+        model_function = _compile_rhs(model_function)
+
+    ### Setup Integration and Communication Loop ###
+    lastIntervalNo, cintAsInt = _interval_counts(runTime, integInt, communInt)
+    n_comm_rows = lastIntervalNo // cintAsInt + 1
+
+    stateVars, params_arr = _sweep_arrays(parameters, initial_stateVars)
+    n_runs = stateVars.shape[0]
+
+    model_results = np.empty((n_runs, n_comm_rows, len(outputs_list)), dtype=dtype)
+    # compiled models are not bounds checked, so evaluate the first run once uncompiled (py_func)
+    # to have numpy raise an IndexError if the model writes past the end of its arrays
+    model_function.py_func(params_arr[0], stateVars[0].copy(), 0.0, np.empty(stateVars.shape[1]), np.empty(len(outputs_list)))
+    _sweep_core(stateVars, params_arr, 0.0, integInt, lastIntervalNo, cintAsInt, model_results, model_function)
+
+    return model_results
+
+
+def _sweep_arrays(parameters, initial_stateVars):
+    # initial states and parameters of a sweep as float64 arrays with one row per run
+    stateVars = np.array(initial_stateVars, dtype=np.float64) # copy, updated in place
+    if isinstance(parameters, list):
+        n_runs = len(parameters)
+        if stateVars.ndim == 1:
+            stateVars = np.tile(stateVars, (n_runs, 1)) # same initial state for every run
+        elif stateVars.shape[0] != n_runs:
+            raise ValueError("initial_stateVars must have one row per dict in parameters")
+        # one row of parameters per run, columns in the key order of the first dict (compiled models read by position)
+        keys = list(parameters[0])
+        if any(run_parameters.keys() != parameters[0].keys() for run_parameters in parameters):
+            raise ValueError("every dict in parameters must have the same keys")
+        params_arr = np.array([[run_parameters[key] for key in keys] for run_parameters in parameters], dtype=np.float64)
+    else:
+        values = [np.asarray(value, dtype=np.float64) for value in parameters.values()]
+        if stateVars.ndim == 1:
+            # same initial state for every run, the parameter arrays set the number of runs
+            shape = np.broadcast_shapes(*(value.shape for value in values))
+            if len(shape) > 1:
+                raise ValueError("each value in parameters must be a number or a 1-D array with one value per run")
+            stateVars = np.tile(stateVars, (shape[0] if shape else 1, 1))
+        elif stateVars.ndim != 2:
+            raise ValueError("initial_stateVars must have shape (number of runs, number of state variables)")
+        n_runs = stateVars.shape[0]
+        # one row of parameters per run, columns in the order of the parameters dict
+        params_arr = np.column_stack([np.broadcast_to(value, n_runs) for value in values])
+    return stateVars, params_arr
+
+
+"""
+runModelSweepCUDA(
+    runTime, integInt, communInt,
+    outputs_list, parameters, initial_stateVars, model_function
+    ), where
+    Same as runModelSweep(), but every run is integrated by its own thread on an NVIDIA GPU. Requires numba.
+    Worthwhile for large sweeps (thousands of runs or more) of small models.
+
+    model_function = model function following the array contract in _rk4_numba.py, compiled as a CUDA device
+        function with @numba.cuda.jit(device=True). Without a GPU the same function is compiled for the CPU and the
+        sweep runs with runModelSweep()
+
+    Returns an array with shape (P, number of communication times, len(outputs_list)), same layout as runModelSweep()
+"""
+def runModelSweepCUDA(runTime,
+                      integInt,
+                      communInt,
+                      outputs_list,
+                      parameters,
+                      initial_stateVars,
+                      model_function,
+                      dtype = np.float64
+                      ):
+
+    from modelling_tools._rk4_cuda import cuda, _sweep_cuda
+    if not cuda.is_available():
+        # the device function's Python source follows the same array contract, so compile it for the CPU instead
+        from modelling_tools._rk4_numba import _compile_rhs
+        logger.warning("runModelSweepCUDA() found no CUDA GPU, running the sweep on the CPU with runModelSweep()")
+        return runModelSweep(runTime, integInt, communInt, outputs_list, parameters, initial_stateVars,
+                             _compile_rhs(model_function.py_func), dtype)
+
+    ### Setup Integration and Communication Loop ###
+    lastIntervalNo, cintAsInt = _interval_counts(runTime, integInt, communInt)
+    n_comm_rows = lastIntervalNo // cintAsInt + 1
+
+    stateVars, params_arr = _sweep_arrays(parameters, initial_stateVars)
+    model_results = np.empty((stateVars.shape[0], n_comm_rows, len(outputs_list)), dtype=dtype)
+    # device functions are not bounds checked either, so evaluate the first run once uncompiled (py_func)
+    # to have numpy raise an IndexError if the model writes past the end of its arrays
+    model_function.py_func(params_arr[0], stateVars[0].copy(), 0.0, np.empty(stateVars.shape[1]), np.empty(len(outputs_list)))
+    _sweep_cuda(stateVars, params_arr, integInt, lastIntervalNo, cintAsInt, model_results, model_function)
+
+    return model_results
@@ -1 +1,263 @@
-from modelling_tools import modelling_tools
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from modelling_tools import runModel, runModelBatch, runModelSweep, runModelSweepCUDA
+
+
+outputs_list = ['t', 'A', 'B', 'concA']
+parameters = {'kAB': 0.42, 'kBO': 0.3, 'vol': 2.0}
+initial_stateVars = [3.8, 4.5]
+
+
+def decay_model(parameters, stateVars, outputs_list, t):
+    A, B = stateVars
+    concA = A / parameters['vol']
+    dAdt = -parameters['kAB'] * concA
+    dBdt = parameters['kAB'] * concA - parameters['kBO'] * B
+    return [dAdt, dBdt], [t, A, B, concA]
+
+
+@pytest.mark.parametrize('method', ['RK45', 'LSODA'])
+def test_solve_ivp_communication_times_within_run(method):
+    # 0.3 * 0.1 * 3 rounds above 0.9, the last communication time must still be inside the run
+    pytest.importorskip('scipy')
+    result = runModel(0, 0.9, 0.1, 0.3, outputs_list, parameters, initial_stateVars, decay_model, method=method)
+    assert result['t'].tolist() == pytest.approx([0.0, 0.3, 0.6, 0.9])
+
+
+def test_batch_matches_runModel():
+    # decay_model returns state variables themselves as outputs, which are views of the batch state
+    kAB = np.array([0.42, 0.5, 0.3])
+    batch_stateVars = np.array([initial_stateVars, initial_stateVars, [1.0, 2.0]])
+    batch = runModelBatch(12, 0.01, 1, outputs_list, dict(parameters, kAB=kAB), batch_stateVars, decay_model)
+    assert batch.shape == (3, 13, len(outputs_list))
+    for run in range(3):
+        single = runModel(0, 12, 0.01, 1, outputs_list, dict(parameters, kAB=kAB[run]),
+                          batch_stateVars[run].tolist(), decay_model)
+        np.testing.assert_allclose(batch[run], single.to_numpy(), rtol=1e-13, atol=1e-15)
+
+
+def decay_model_arrays(parameters, stateVars, t, differential_return, variable_returns):
+    # decay_model following the array contract of compiled models, parameters in the order kAB, kBO, vol
+    kAB, kBO, vol = parameters[0], parameters[1], parameters[2]
+    A = stateVars[0]
+    B = stateVars[1]
+    concA = A / vol
+    differential_return[0] = -kAB * concA
+    differential_return[1] = kAB * concA - kBO * B
+    variable_returns[0] = t
+    variable_returns[1] = A
+    variable_returns[2] = B
+    variable_returns[3] = concA
+
+
+def test_sweep_parameter_dicts_in_any_key_order():
+    pytest.importorskip('numba')
+    reordered = {'vol': 2.0, 'kBO': 0.3, 'kAB': 0.5}
+    sweep = runModelSweep(12, 0.01, 1, outputs_list, [parameters, reordered], initial_stateVars, decay_model_arrays)
+    for run, run_parameters in enumerate([parameters, reordered]):
+        single = runModel(0, 12, 0.01, 1, outputs_list, run_parameters, initial_stateVars, decay_model)
+        np.testing.assert_allclose(sweep[run], single.to_numpy(), rtol=1e-13, atol=1e-15)
+
+
+def test_sweep_parameter_dicts_must_share_keys():
+    pytest.importorskip('numba')
+    with pytest.raises(ValueError):
+        runModelSweep(12, 0.01, 1, outputs_list, [parameters, {'kAB': 0.5, 'kBO': 0.3}], initial_stateVars,
+                      decay_model_arrays)
+
+
+def test_cashkarp_rejects_nan():
+    numba = pytest.importorskip('numba')
+
+    @numba.njit
+    def nan_model(parameters, stateVars, t, differential_return, variable_returns):
+        differential_return[0] = np.nan
+        variable_returns[0] = t
+        variable_returns[1] = stateVars[0]
+
+    with pytest.raises(RuntimeError):
+        runModel(0, 1, 0.1, 0.5, ['t', 'A'], {'k': 1.0}, [1.0], nan_model, method='cashkarp')
+
+
+def test_jit_model_without_source_file():
+    # functions from exec (or python -c, stdin) cannot be cached on disk, they are still compiled
+    pytest.importorskip('numba')
+    namespace = {}
+    exec("def exp_decay(parameters, stateVars, t, differential_return, variable_returns):\n"
+         "    differential_return[0] = -parameters[0] * stateVars[0]\n"
+         "    variable_returns[0] = t\n"
+         "    variable_returns[1] = stateVars[0]\n", namespace)
+    final_stateVars = runModel(0, 1, 0.01, 0.5, ['t', 'A'], {'k': 1.0}, [1.0], namespace['exp_decay'], jit=True,
+                               return_trajectory=False)
+    assert final_stateVars[0] == pytest.approx(np.exp(-1), rel=1e-9)
+    result = runModel(0, 1, 0.01, 0.5, ['t', 'A'], {'k': 2.0}, [1.0], namespace['exp_decay'], jit=True)
+    sweep = runModelSweep(1, 0.01, 0.5, ['t', 'A'], {'k': np.array([1.0, 2.0])}, [[1.0], [1.0]], namespace['exp_decay'])
+    np.testing.assert_allclose(sweep[1], result.to_numpy(), rtol=1e-13)
+
+
+def test_jit_with_already_compiled_model():
+    numba = pytest.importorskip('numba')
+    compiled_result = runModel(0, 12, 0.01, 1, outputs_list, parameters, initial_stateVars,
+                               numba.njit(decay_model_arrays), jit=True)
+    result = runModel(0, 12, 0.01, 1, outputs_list, parameters, initial_stateVars, decay_model_arrays, jit=True)
+    np.testing.assert_array_equal(compiled_result.to_numpy(), result.to_numpy())
+
+
+def test_sweep_shares_one_initial_state():
+    pytest.importorskip('numba')
+    kAB = np.array([0.42, 0.5, 0.3])
+    shared = runModelSweep(12, 0.01, 1, outputs_list, dict(parameters, kAB=kAB), initial_stateVars, decay_model_arrays)
+    rows = runModelSweep(12, 0.01, 1, outputs_list, dict(parameters, kAB=kAB), [initial_stateVars] * 3,
+                         decay_model_arrays)
+    assert shared.shape == (3, 13, len(outputs_list))
+    np.testing.assert_array_equal(shared, rows)
+
+
+def test_compiled_rk4_matches_python_model():
+    pytest.importorskip('numba')
+    python_result = runModel(0, 12, 0.01, 1, outputs_list, parameters, initial_stateVars, decay_model)
+    compiled_result = runModel(0, 12, 0.01, 1, outputs_list, parameters, initial_stateVars, decay_model_arrays, jit=True)
+    np.testing.assert_allclose(compiled_result.to_numpy(), python_result.to_numpy(), rtol=1e-13, atol=1e-15)
+
+
+def test_sweep_matches_runModel():
+    pytest.importorskip('numba')
+    kAB = np.array([0.42, 0.5, 0.3])
+    sweep_stateVars = np.array([initial_stateVars, initial_stateVars, [1.0, 2.0]])
+    sweep = runModelSweep(12, 0.01, 1, outputs_list, dict(parameters, kAB=kAB), sweep_stateVars, decay_model_arrays)
+    assert sweep.shape == (3, 13, len(outputs_list))
+    for run in range(3):
+        single = runModel(0, 12, 0.01, 1, outputs_list, dict(parameters, kAB=kAB[run]),
+                          sweep_stateVars[run].tolist(), decay_model)
+        np.testing.assert_allclose(sweep[run], single.to_numpy(), rtol=1e-13, atol=1e-15)
+
+
+def test_sweep_cuda_matches_sweep_in_simulator():
+    # the CUDA simulator has to be switched on before numba.cuda is first imported, so run in a fresh process
+    pytest.importorskip('numba')
+    script = (
+        "import numpy as np\n"
+        "from numba import cuda, njit\n"
+        "from modelling_tools import runModelSweep, runModelSweepCUDA\n"
+        "from test_modelling_tools import decay_model_arrays, outputs_list, parameters, initial_stateVars\n"
+        "kAB = np.array([0.42, 0.5, 0.3])\n"
+        "gpu = runModelSweepCUDA(2, 0.1, 1, outputs_list, dict(parameters, kAB=kAB), initial_stateVars,\n"
+        "                        cuda.jit(device=True)(decay_model_arrays))\n"
+        "cpu = runModelSweep(2, 0.1, 1, outputs_list, dict(parameters, kAB=kAB), initial_stateVars, decay_model_arrays)\n"
+        "np.testing.assert_allclose(gpu, cpu, rtol=1e-13, atol=1e-15)\n"
+        "try:\n"
+        "    runModelSweepCUDA(2, 0.1, 1, outputs_list[:3], dict(parameters, kAB=kAB), initial_stateVars,\n"
+        "                      cuda.jit(device=True)(decay_model_arrays))\n"
+        "except IndexError:\n"
+        "    pass\n"
+        "else:\n"
+        "    raise AssertionError('a model writing past variable_returns must raise IndexError')\n"
+    )
+    env = dict(os.environ, NUMBA_ENABLE_CUDASIM='1')
+    env['PYTHONPATH'] = os.pathsep.join([os.path.dirname(__file__), env.get('PYTHONPATH', '')])
+    completed = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True)
+    assert completed.returncode == 0, completed.stderr
+
+
+def test_sweep_cuda_without_gpu_runs_on_cpu():
+    pytest.importorskip('numba')
+    from numba import cuda
+    if cuda.is_available():
+        pytest.skip('a CUDA GPU is available')
+    kAB = np.array([0.42, 0.5, 0.3])
+    fallback = runModelSweepCUDA(2, 0.1, 1, outputs_list, dict(parameters, kAB=kAB), initial_stateVars,
+                                 cuda.jit(device=True)(decay_model_arrays))
+    cpu = runModelSweep(2, 0.1, 1, outputs_list, dict(parameters, kAB=kAB), initial_stateVars, decay_model_arrays)
+    np.testing.assert_array_equal(fallback, cpu)
+
+
+@pytest.mark.parametrize('method, compiled, requires', [
+    ('RK45', False, 'scipy'),
+    ('LSODA', False, 'scipy'),
+    ('BDF', False, 'scipy'),
+    ('RK45', True, 'scipy'),
+    ('cashkarp', True, 'numba'),
+    ('numbalsoda', True, 'numbalsoda'),
+])
+def test_adaptive_methods_match_fine_rk4(method, compiled, requires):
+    pytest.importorskip(requires)
+    if compiled:
+        pytest.importorskip('numba')
+    reference = runModel(0, 12, 0.001, 1, outputs_list, parameters, initial_stateVars, decay_model)
+    model_function = decay_model_arrays if compiled else decay_model
+    result = runModel(0, 12, 0.1, 1, outputs_list, parameters, initial_stateVars, model_function,
+                      method=method, rtol=1e-9, atol=1e-12, jit=compiled)
+    assert result.shape == reference.shape
+    np.testing.assert_allclose(result.to_numpy(), reference.to_numpy(), rtol=1e-6, atol=1e-9)
+
+
+def test_adaptive_method_needs_compiled_model():
+    with pytest.raises(ValueError):
+        runModel(0, 1, 0.1, 0.5, outputs_list, parameters, initial_stateVars, decay_model, method='cashkarp')
+
+
+@pytest.mark.parametrize('Start', [0, 1])
+def test_compiled_model_writing_too_many_outputs_raises(Start):
+    numba = pytest.importorskip('numba')
+
+    @numba.njit
+    def oversized_model(parameters, stateVars, t, differential_return, variable_returns):
+        differential_return[0] = -parameters[0] * stateVars[0]
+        variable_returns[0] = t
+        variable_returns[1] = stateVars[0]
+        variable_returns[2] = stateVars[0] # one more than outputs_list
+
+    prev_output = pd.DataFrame({'t': [1.0], 'A': [1.0]}) # only read for Start=1
+    with pytest.raises(IndexError):
+        runModel(Start, 1, 0.1, 0.5, ['t', 'A'], {'k': 1.0}, [1.0], oversized_model, prev_output=prev_output)
+
+
+@pytest.mark.parametrize('Start', [0, 1])
+def test_python_model_returning_too_many_outputs_raises(Start):
+    prev_output = pd.DataFrame({'t': [1.0], 'A': [3.8], 'B': [4.5]}) # only read for Start=1
+    with pytest.raises(ValueError, match='one value per name in outputs_list'):
+        runModel(Start, 1, 0.1, 0.5, outputs_list[:3], parameters, initial_stateVars, decay_model, prev_output=prev_output)
+
+
+@pytest.mark.parametrize('trailing_slash, fileextension', [(False, '.csv'), (True, '.csv'), (False, '.csv.gz')])
+def test_output_file(tmp_path, trailing_slash, fileextension):
+    filepath = str(tmp_path) + '/' if trailing_slash else str(tmp_path)
+    result = runModel(0, 2, 0.1, 0.5, outputs_list, parameters, initial_stateVars, decay_model, output_file=True,
+                      filepath=filepath, filename='decay_', fileextension=fileextension)
+    saved_files = list(tmp_path.glob('decay_*' + fileextension))
+    assert len(saved_files) == 1
+    if fileextension == '.csv.gz':
+        assert saved_files[0].read_bytes()[:2] == b'\x1f\x8b' # gzip header
+    pd.testing.assert_frame_equal(pd.read_csv(saved_files[0]), result)
+
+
+def test_communication_interval_not_truncated():
+    # 0.3 / 0.1 is 2.9999999999999996, which int() would truncate to 2 steps per communication interval
+    result = runModel(0, 0.9, 0.1, 0.3, outputs_list, parameters, initial_stateVars, decay_model)
+    assert result['t'].tolist() == pytest.approx([0.0, 0.3, 0.6, 0.9])
+
+
+@pytest.mark.parametrize('runTime, integInt, communInt', [(1.05, 0.1, 0.5), (1, 0.1, 0.25)])
+def test_intervals_must_be_whole_numbers_of_integInt(runTime, integInt, communInt):
+    with pytest.raises(ValueError):
+        runModel(0, runTime, integInt, communInt, outputs_list, parameters, initial_stateVars, decay_model)
+
+
+def test_prev_output_list_matches_dataframe_chaining():
+    first = runModel(0, 2, 0.1, 0.5, outputs_list, parameters, initial_stateVars, decay_model)
+    chained_frame = first
+    chained_list = [first]
+    for _ in range(3):
+        stateVars = chained_frame[['A', 'B']].iloc[-1].tolist()
+        chained_frame = runModel(1, 2, 0.1, 0.5, outputs_list, parameters, stateVars, decay_model,
+                                 prev_output=chained_frame)
+        returned = runModel(1, 2, 0.1, 0.5, outputs_list, parameters, stateVars, decay_model, prev_output=chained_list)
+        assert returned is chained_list # the caller's list is appended to and returned
+    assert len(chained_list) == 4
+    pd.testing.assert_frame_equal(pd.concat(chained_list, ignore_index=True), chained_frame)